@@ -36,6 +36,7 @@ Summary:        Koji hub plugin for osbuild composer integration
 Requires:       %{name} = %{version}-%{release}
 Requires:       koji-builder
 Requires:       python3-requests
+Recommends:     python3-orjson
 
 %description    builder
 Koji builder plugin for osbuild composer integration.
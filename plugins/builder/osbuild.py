@@ -24,7 +24,7 @@ import logging
 import urllib.parse
 
 from string import Template
-from typing import Dict, List, Optional, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 import requests
 import koji
@@ -33,6 +33,11 @@ from requests.adapters import HTTPAdapter, Retry
 from koji.daemon import fast_incremental_upload
 from koji.tasks import BaseTaskHandler
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 DEFAULT_COMPOSER_URL = "https://localhost"
 DEFAULT_KOJIHUB_URL = "https://localhost/kojihub"
@@ -52,6 +57,21 @@ KOJIAPI_IMAGE_TYPES = {
     "ec2-sap": "aws-sap-rhui",
 }
 
+
+def dumps_json(data) -> bytes:
+    """Serialize `data` to UTF-8 encoded JSON, via orjson if available"""
+    if orjson:
+        return orjson.dumps(data)
+    return json.dumps(data, allow_nan=False).encode("utf-8")
+
+
+def loads_json(raw: bytes):
+    """Deserialize JSON from `raw` bytes, via orjson if available"""
+    if orjson:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
 # The following classes are a implementation of osbuild composer's
 # cloud API. It is based on the corresponding OpenAPI specification
 # version '2' with integrated koji support (>= commit c81d0d0).
@@ -81,11 +101,16 @@ class OSTreeOptions:
 
 
 class Repository:
+    __slots__ = ("baseurl", "gpgkey", "package_sets", "rhsm", "_urls")
+
     def __init__(self, baseurl: str):
         self.baseurl = baseurl
         self.gpgkey = None
         self.package_sets: Optional[List[str]] = None
         self.rhsm = False
+        # substituted urls, keyed by base url and architecture, so
+        # that changing `baseurl` never returns a stale url
+        self._urls: Dict[Tuple[str, str], str] = {}
 
     @classmethod
     def from_data(cls, data: Union[str, Dict]) -> "Repository":
@@ -96,9 +121,19 @@ class Repository:
         repo.package_sets = data.get("package_sets")
         return repo
 
+    def url_for_arch(self, arch: str) -> str:
+        key = (self.baseurl, arch)
+        url = self._urls.get(key)
+        if url is None:
+            url = self.baseurl
+            # only urls with placeholders need the template engine
+            if "$" in url:
+                url = Template(url).substitute(arch=arch)
+            self._urls[key] = url
+        return url
+
     def as_dict(self, arch: str = ""):
-        tmp = Template(self.baseurl)
-        url = tmp.substitute(arch=arch)
+        url = self.url_for_arch(arch)
         res = {
             "baseurl": url,
             "rhsm": self.rhsm
@@ -112,6 +147,8 @@ class Repository:
 
 
 class ImageRequest:
+    __slots__ = ("architecture", "image_type", "repositories", "ostree", "upload_options")
+
     def __init__(self, arch: str, image_type: str, repos: List):
         self.architecture = arch
         self.image_type = image_type
@@ -154,6 +191,8 @@ class NVR:
 
 
 class ComposeRequest:
+    __slots__ = ("distribution", "image_requests", "koji", "customizations")
+
     class Koji:
         def __init__(self, server: str, task_id: int, nvr: NVR):
             self.server = server
@@ -236,6 +275,10 @@ class ComposeStatus:
     PENDING = "pending"
     REGISTERING = "registering"
 
+    FINISHED_STATES = frozenset([SUCCESS, FAILURE])
+
+    __slots__ = ("status", "images", "koji_task_id", "koji_build_id")
+
     def __init__(self, status: str, images: List, task_id: int, build_id):
         self.status = status
         self.images = images
@@ -269,13 +312,11 @@ class ComposeStatus:
 
     @property
     def is_finished(self):
-        if self.is_success:
-            return True
-        return self.status in [self.FAILURE]
+        return self.status in self.FINISHED_STATES
 
     @property
     def is_success(self):
-        return self.status in [self.SUCCESS]
+        return self.status == self.SUCCESS
 
 
 class ComposeLogs:
@@ -354,7 +395,7 @@ class OAuth2(requests.auth.AuthBase):
             msg = f"Failed to authenticate via SSO/OAuth: {body}"
             raise koji.GenericError(msg) from None
 
-        token_data = res.json()
+        token_data = loads_json(res.content)
         self.token = self.Token(token_data, token_created)
 
     def __call__(self, r: requests.Request):
@@ -368,10 +409,27 @@ class OAuth2(requests.auth.AuthBase):
         return r
 
 
+class ComposerError(koji.GenericError):
+    """Error reply from composer, with the HTTP status code"""
+
+    def __init__(self, msg: str, status_code: int) -> None:
+        super().__init__(msg)
+        self.status_code = status_code
+
+    @property
+    def is_transient(self) -> bool:
+        """Server side errors that might go away on their own"""
+        return self.status_code >= 500
+
+
 class Client:
     def __init__(self, url):
         self.server = url
         self.url = urllib.parse.urljoin(url, API_BASE)
+        # The API base always ends with a slash, so urls for
+        # individual composes can be built by simple concatenation
+        self.compose_url = urllib.parse.urljoin(self.url, "compose")
+        self.composes_url = urllib.parse.urljoin(self.url, "composes/")
         self.http = requests.Session()
 
         retries = Retry(total=5,
@@ -380,7 +438,12 @@ class Client:
                         raise_on_status=False
                         )
 
-        self.http.mount(self.server, HTTPAdapter(max_retries=retries))
+        # All API calls go to a single composer host; keep one pool
+        # around so the connection is re-used across status polls.
+        adapter = HTTPAdapter(max_retries=retries,
+                              pool_connections=1,
+                              pool_maxsize=4)
+        self.http.mount(self.server, adapter)
 
     @staticmethod
     def parse_certs(string):
@@ -407,9 +470,13 @@ class Client:
         return False
 
     def request(self, method: str, url: str, js: Optional[Dict] = None):
+        data, headers = None, None
+        if js is not None:
+            data = dumps_json(js)
+            headers = {"Content-Type": "application/json"}
 
         self.oauth_check()
-        res = self.http.request(method, url, json=js)
+        res = self.http.request(method, url, data=data, headers=headers)
 
         # If 401 is returned, check if oauth is enabled. If it is, get
         # a new access token and then retry the request.
@@ -418,7 +485,7 @@ class Client:
         # already invalid. This retrying mechanism serves as the last resort
         # attempt to get the request through.
         if res.status_code == 401 and self.oauth_check(True):
-            res = self.http.request(method, url, json=js)
+            res = self.http.request(method, url, data=data, headers=headers)
 
         return res
 
@@ -429,66 +496,98 @@ class Client:
         return self.request("POST", url, js=js)
 
     def compose_create(self, compose_request: ComposeRequest):
-        url = urllib.parse.urljoin(self.url, "compose")
+        return self.compose_create_raw(compose_request.as_dict())
 
-        data = compose_request.as_dict()
-        res = self.post(url, js=data)
+    def compose_create_raw(self, data: Dict):
+        """Create a compose from an already built request dict"""
+        res = self.post(self.compose_url, js=data)
 
         if res.status_code != 201:
             body = res.content.decode("utf-8").strip()
             msg = f"Failed to create the compose request: {body}"
-            raise koji.GenericError(msg) from None
+            raise ComposerError(msg, res.status_code) from None
 
-        ps = res.json()
+        ps = loads_json(res.content)
         return ps["id"]  # the compose id
 
     def compose_status(self, compose_id: str):
-        url = urllib.parse.urljoin(self.url, f"composes/{compose_id}")
+        url = f"{self.composes_url}{compose_id}"
 
         res = self.get(url)
 
         if res.status_code != 200:
             body = res.content.decode("utf-8").strip()
             msg = f"Failed to get the compose status: {body}"
-            raise koji.GenericError(msg) from None
+            raise ComposerError(msg, res.status_code) from None
 
-        return ComposeStatus.from_dict(res.json())
+        return ComposeStatus.from_dict(loads_json(res.content))
 
     def compose_logs(self, compose_id: str):
-        url = urllib.parse.urljoin(self.url, f"composes/{compose_id}/logs")
+        url = f"{self.composes_url}{compose_id}/logs"
 
         res = self.get(url)
 
         if res.status_code != 200:
             body = res.content.decode("utf-8").strip()
             msg = f"Failed to get the compose logs: {body}"
-            raise koji.GenericError(msg) from None
+            raise ComposerError(msg, res.status_code) from None
 
-        return ComposeLogs.from_dict(res.json())
+        return ComposeLogs.from_dict(loads_json(res.content))
 
     def compose_manifests(self, compose_id: str):
-        url = urllib.parse.urljoin(self.url, f"composes/{compose_id}/manifests")
+        url = f"{self.composes_url}{compose_id}/manifests"
 
         res = self.get(url)
 
         if res.status_code != 200:
             body = res.content.decode("utf-8").strip()
             msg = f"Failed to get the compose manifests: {body}"
-            raise koji.GenericError(msg) from None
+            raise ComposerError(msg, res.status_code) from None
 
-        js = res.json()
+        js = loads_json(res.content)
         return js.get("manifests", [])
 
-    def wait_for_compose(self, compose_id: str, *, sleep_time=2, callback=None):
+    def wait_for_compose(self, compose_id: str, *,
+                         sleep_time=2, max_sleep_time=60, max_failures=10, callback=None):
+        # Poll with an exponential backoff: the delay is doubled, up to
+        # `max_sleep_time`, as long as the status does not change or
+        # fetching it fails transiently, and reset whenever it changes.
+        # After `max_failures` consecutive transient failures the last
+        # error is raised. Any other error, e.g. an unknown compose or
+        # failed authentication, is raised right away.
+        delay = sleep_time
+        last = None
+        failures = 0
         while True:
-            status = self.compose_status(compose_id)
-            if callback:
-                callback(status)
-
-            if status.is_finished:
-                return status
-
-            time.sleep(sleep_time)
+            started = time.monotonic()
+            try:
+                status = self.compose_status(compose_id)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                    ComposerError) as err:
+                if isinstance(err, ComposerError) and not err.is_transient:
+                    raise
+                failures += 1
+                if failures >= max_failures:
+                    raise
+                delay = min(delay * 2, max_sleep_time)
+            else:
+                failures = 0
+
+                if callback:
+                    callback(status)
+
+                if status.is_finished:
+                    return status
+
+                if status.status != last:
+                    delay = sleep_time
+                else:
+                    delay = min(delay * 2, max_sleep_time)
+                last = status.status
+
+            # the delay is counted from the start of the last request
+            time.sleep(max(0, started + delay - time.monotonic()))
 
 
 class OSBuildImage(BaseTaskHandler):
@@ -608,14 +707,14 @@ class OSBuildImage(BaseTaskHandler):
         repo_info = self.getRepo(target_info['build_tag'])
         if not repo_info:
             return None
-        self.logger.debug("repo info: %s", str(repo_info))
+        self.logger.debug("repo info: %s", repo_info)
         path_info = koji.PathInfo(topdir=self.options.topurl)
         repourl = path_info.repo(repo_info['id'], target_info['build_tag_name'])
         self.logger.debug("repo url: %s", repourl)
         return [Repository(repourl + "/$arch")]
 
     def make_repos_for_user(self, repos):
-        self.logger.debug("user repo override: %s", str(repos))
+        self.logger.debug("user repo override: %s", repos)
         return [Repository.from_data(r) for r in repos]
 
     def map_koji_api_image_type(self, image_type: str) -> str:
@@ -650,7 +749,7 @@ class OSBuildImage(BaseTaskHandler):
     def handler(self, name, version, distro, image_type, target, arches, opts):
         """Main entry point for the task"""
         self.logger.debug("Building image via osbuild %s, %s, %s, %s",
-                          name, str(arches), str(target), str(opts))
+                          name, arches, target, opts)
 
         self.logger.info("Task id: %s", str(self.id))
 
@@ -699,12 +798,6 @@ class OSBuildImage(BaseTaskHandler):
             for ireq in ireqs:
                 ireq.upload_options = upload_options
 
-        self.logger.debug("Creating compose: %s (%s)\n  koji: %s\n  images: %s",
-                          nvr, distro, self.koji_url,
-                          str([i.as_dict() for i in ireqs]))
-
-        self.logger.debug("Composer API: %s", self.client.url)
-
         # Setup done, create the compose request and send it off
         kojidata = ComposeRequest.Koji(self.koji_url, self.id, nvr)
         request = ComposeRequest(distro, ireqs, kojidata)
@@ -712,15 +805,26 @@ class OSBuildImage(BaseTaskHandler):
         # Additional customizations are passed through
         request.customizations = opts.get("customizations")
 
-        self.upload_json(request.as_dict(), "compose-request")
+        # Serialize the request only once and use it for logging, the
+        # upload and the actual request to composer
+        data = request.as_dict()
 
-        cid = client.compose_create(request)
+        self.logger.debug("Creating compose: %s (%s)\n  koji: %s\n  images: %s",
+                          nvr, distro, self.koji_url,
+                          data["image_requests"])
+
+        self.logger.debug("Composer API: %s", self.client.url)
+
+        self.upload_json(data, "compose-request")
+
+        cid = client.compose_create_raw(data)
         self.logger.info("Compose id: %s", cid)
 
         self.logger.debug("Waiting for compose to finish")
         status = client.wait_for_compose(cid, callback=self.on_status_update)
 
-        self.logger.debug("Compose finished: %s", str(status.as_dict()))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Compose finished: %s", status.as_dict())
         self.logger.info("Compose result: %s", status.status)
 
         self.attach_manifests(cid, ireqs)
@@ -781,14 +885,12 @@ def compose_cmd(client: Client, args):
     cid = client.compose_create(request)
 
     print(f"Compose: {cid}")
-    while True:
-        status = client.compose_status(cid)
-        print(f"status: {status.status: <10}\r", end="")
-        if status.is_finished:
-            break
 
-        time.sleep(2)
+    def show_status(status):
+        print(f"status: {status.status: <10}\r", end="")
 
+    # interactive use, don't let the poll interval grow too much
+    status = client.wait_for_compose(cid, max_sleep_time=10, callback=show_status)
     show_compose(status)
     return 0
 
@@ -1,7 +1,6 @@
 """Koji osbuild integration for Koji Hub"""
 import sys
 import logging
-import jsonschema
 
 import koji
 from koji.context import context
@@ -18,6 +17,7 @@ OSBUILD_IMAGE_SCHEMA = {
     "title": "osbuildImage arguments",
     "type": "array",
     "minItems": 7,
+    "maxItems": 7,
     "items": [
         {
             "type": "string",
@@ -230,34 +230,94 @@ OSBUILD_IMAGE_SCHEMA = {
     }
 }
 
+# Upper bound for the number of images in a single osbuildImages call,
+# all of which are created within one hub transaction
+OSBUILD_IMAGES_MAX_BATCH = 64
 
-@koji.plugin.export
-def osbuildImage(name, version, distro, image_type, target, arches, opts=None, priority=None):
-    """Create an image via osbuild"""
-    context.session.assertPerm("image")
-    args = [name, version, distro, image_type, target, arches, opts]
-    task = {"channel": "image"}
+# The schema is fixed, so create the validator only once instead of
+# re-checking and re-compiling the schema for every task. It is created
+# on first use, see `validate_image_args`.
+OSBUILD_IMAGE_VALIDATOR = None
+
+
+def validate_image_args(args):
+    """Validate the osbuildImage arguments against the schema
 
-    logger.info("Create osbuildImage task")
+    jsonschema is only imported when arguments are validated for the
+    first time, so hubs that never create osbuildImage tasks do not
+    pay for loading it. Creating the validator twice, when racing
+    with another thread, is harmless.
+    """
+    global OSBUILD_IMAGE_VALIDATOR  # pylint: disable=global-statement
+    import jsonschema  # pylint: disable=import-outside-toplevel
+
+    if OSBUILD_IMAGE_VALIDATOR is None:
+        OSBUILD_IMAGE_VALIDATOR = jsonschema.Draft4Validator(OSBUILD_IMAGE_SCHEMA)
 
     try:
-        jsonschema.validate(args, OSBUILD_IMAGE_SCHEMA)
+        OSBUILD_IMAGE_VALIDATOR.validate(args)
     except jsonschema.exceptions.ValidationError as err:
         raise koji.ParameterError(str(err)) from None
 
+
+def parse_image_args(args):
+    """Validate and normalize the arguments of an osbuildImage task"""
+    validate_image_args(args)
+
+    name, version, distro, image_type, target, arches, opts = args
+
     # Support array for backwards compatibility
     # This check must be done after the schema validation
     if isinstance(image_type, list):
         image_type = image_type[0]
-        args = [name, version, distro, image_type, target, arches, opts]
 
-    if priority and priority < 0 and not context.session.hasPerm('admin'):
-        raise koji.ActionNotAllowed('only admins may create high-priority tasks')
+    return [name, version, distro, image_type, target, arches, opts]
 
-    # If task_id is returned from Koji Hub we assume
-    # that the task has been added to the database
-    task_id = kojihub.make_task('osbuildImage', args, **task)
-    if task_id:
-        logger.info("osbuildImage task %i added to database", task_id)
 
-    return task_id
+@koji.plugin.export
+def osbuildImages(batch, priority=None):
+    """Create multiple images via osbuild
+
+    Each entry of `batch` is the list of arguments for a single
+    `osbuildImage` call, without the priority. All entries are
+    validated before any task is created and all tasks are created
+    within the transaction of this single hub call.
+    Returns the list of task ids, in the order of `batch`.
+    """
+    context.session.assertPerm("image")
+    task = {"channel": "image"}
+
+    if not isinstance(batch, list) or not all(isinstance(args, list) for args in batch):
+        raise koji.ParameterError("batch must be a list of argument lists")
+
+    if not 0 < len(batch) <= OSBUILD_IMAGES_MAX_BATCH:
+        msg = f"batch must have between 1 and {OSBUILD_IMAGES_MAX_BATCH} entries"
+        raise koji.ParameterError(msg)
+
+    logger.info("Create %i osbuildImage task(s)", len(batch))
+
+    batch = [parse_image_args(args) for args in batch]
+
+    if priority:
+        if priority < 0 and not context.session.hasPerm('admin'):
+            raise koji.ActionNotAllowed('only admins may create high-priority tasks')
+        # like koji's own calls, the priority is relative to the default
+        task["priority"] = koji.PRIO_DEFAULT + priority
+
+    task_ids = []
+    for args in batch:
+        # If task_id is returned from Koji Hub we assume
+        # that the task has been added to the database
+        task_id = kojihub.make_task('osbuildImage', args, **task)
+        if task_id:
+            logger.info("osbuildImage task %i added to database", task_id)
+        task_ids.append(task_id)
+
+    return task_ids
+
+
+@koji.plugin.export
+def osbuildImage(name, version, distro, image_type, target, arches, opts=None, priority=None):
+    """Create an image via osbuild"""
+    args = [name, version, distro, image_type, target, arches, opts]
+    return osbuildImages([args], priority=priority)[0]
@@ -706,6 +706,31 @@ class TestBuilderPlugin(PluginTest): # pylint: disable=too-many-public-methods
         # build should have been tagged
         self.assertIn(build_id, session.host.tags)
 
+    @httpretty.activate
+    def test_compose_json_fallback(self):
+        # Check the plugin works with the standard library json
+        # module when orjson is not available
+        setattr(self.plugin, "orjson", None)
+
+        session = self.mock_session()
+        handler = self.make_handler(session=session)
+
+        arches = ["x86_64"]
+        args = ["name", "version", "distro",
+                "image_type",
+                "fedora-candidate",
+                arches,
+                {}]
+
+        url = self.plugin.DEFAULT_COMPOSER_URL
+        composer = MockComposer(url, architectures=arches)
+        composer.httpretty_register()
+
+        res = handler.handler(*args)
+        assert res, "invalid compose result"
+        compose_id = res["composer"]["id"]
+        self.assertIn(compose_id, composer.composes)
+
     @httpretty.activate
     def test_compose_failure(self):
         # Simulate a failed compose, check exception is raised
@@ -1258,3 +1283,148 @@ class TestBuilderPlugin(PluginTest): # pylint: disable=too-many-public-methods
 
         client = self.plugin.Client("http://localhost")
         client.wait_for_compose(compose_id, sleep_time=0.1)
+
+    def test_repository_url(self):
+        repo = self.plugin.Repository("http://download.localhost/$arch")
+        self.assertEqual(repo.as_dict("x86_64")["baseurl"], "http://download.localhost/x86_64")
+        self.assertEqual(repo.as_dict("s390x")["baseurl"], "http://download.localhost/s390x")
+
+        # changing the base url must not return stale urls
+        repo.baseurl = "http://mirror.localhost/$arch"
+        self.assertEqual(repo.as_dict("x86_64")["baseurl"], "http://mirror.localhost/x86_64")
+
+    def test_compose_status_from_dict(self):
+        data = {
+            "status": "FAILURE",
+            "koji_status": {
+                "task_id": 23,
+                "build_id": 42,
+            },
+            "image_statuses": [
+                {"status": "success"},
+                {
+                    "status": "failure",
+                    "error": {"id": 10, "reason": "failed"}
+                }
+            ]
+        }
+
+        cs = self.plugin.ComposeStatus.from_dict(data)
+        self.assertTrue(cs.is_finished)
+        self.assertFalse(cs.is_success)
+        self.assertEqual(cs.koji_task_id, 23)
+        self.assertEqual(cs.koji_build_id, 42)
+
+        images = cs.images
+        self.assertEqual([i.status for i in images], ["success", "failure"])
+        self.assertEqual(images[1].error.as_dict(), {"id": 10, "reason": "failed"})
+
+        res = cs.as_dict()
+        self.assertEqual(res["status"], "failure")
+        self.assertEqual(len(res["image_statuses"]), 2)
+
+    @httpretty.activate
+    def test_compose_status_backoff(self):
+        compose_id = "43e57e63-ab32-4a8d-854d-3bbc117fdce3"
+
+        MockComposerStatus(compose_id).httpretty_register()
+
+        client = self.plugin.Client("http://localhost")
+        with unittest.mock.patch.object(self.plugin.time, "sleep") as sleep:
+            client.wait_for_compose(compose_id, sleep_time=1, max_sleep_time=4)
+
+        # the status stays "pending" for five polls, the delay must be
+        # doubled for each one of them but not exceed the maximum; the
+        # time spent in the request itself is subtracted
+        delays = [c.args[0] for c in sleep.call_args_list]
+        self.assertEqual(len(delays), 5)
+        for have, want in zip(delays, [1, 2, 4, 4, 4]):
+            self.assertAlmostEqual(have, want, delta=0.5)
+
+    def test_compose_status_transient_failures(self):
+        status = self.plugin.ComposeStatus.from_dict({
+            "status": "success",
+            "image_statuses": [{"status": "success"}]
+        })
+        replies = [
+            requests.exceptions.ConnectionError("connection refused"),
+            self.plugin.ComposerError("Failed to get the compose status: I'm flaky!", 503),
+            status
+        ]
+
+        client = self.plugin.Client("http://localhost")
+        with unittest.mock.patch.object(client, "compose_status", side_effect=replies), \
+             unittest.mock.patch.object(self.plugin.time, "sleep") as sleep:
+            res = client.wait_for_compose("compose", sleep_time=1, max_failures=3)
+
+        self.assertIs(res, status)
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_compose_status_failures(self):
+        error = self.plugin.ComposerError("Failed to get the compose status: I'm flaky!", 503)
+
+        client = self.plugin.Client("http://localhost")
+        with unittest.mock.patch.object(client, "compose_status", side_effect=error) as cs, \
+             unittest.mock.patch.object(self.plugin.time, "sleep") as sleep:
+            with self.assertRaises(koji.GenericError):
+                client.wait_for_compose("compose", sleep_time=1, max_failures=3)
+
+        # the error is raised after `max_failures` consecutive failures
+        self.assertEqual(cs.call_count, 3)
+        self.assertEqual(sleep.call_count, 2)
+
+    @httpretty.activate
+    def test_compose_status_unknown_compose(self):
+        compose_id = "43e57e63-ab32-4a8d-854d-3bbc117fdce3"
+        calls = []
+
+        def compose_status(_request, _uri, response_headers):
+            calls.append(1)
+            return [404, response_headers, f"Unknown compose: {compose_id}"]
+
+        httpretty.register_uri(
+            httpretty.GET,
+            urllib.parse.urljoin(f"http://localhost/{API_BASE}", f"composes/{compose_id}"),
+            body=compose_status
+        )
+
+        client = self.plugin.Client("http://localhost")
+        with unittest.mock.patch.object(self.plugin.time, "sleep") as sleep:
+            with self.assertRaises(self.plugin.ComposerError) as ctx:
+                client.wait_for_compose(compose_id)
+
+        # permanent errors must be raised right away, without retrying
+        self.assertEqual(ctx.exception.status_code, 404)
+        self.assertEqual(len(calls), 1)
+        sleep.assert_not_called()
+
+    @httpretty.activate
+    def test_compose_status_unavailable(self):
+        compose_id = "43e57e63-ab32-4a8d-854d-3bbc117fdce3"
+        calls = []
+
+        # fail more often than the adapter retries on its own, so that
+        # a 503 makes it to `wait_for_compose`
+        def compose_status(_request, _uri, response_headers):
+            calls.append(1)
+            if len(calls) <= 6:
+                return [503, response_headers, "Service Unavailable"]
+            result = {
+                "status": "success",
+                "koji_status": {"build_id": 42},
+                "image_statuses": [{"status": "success"}]
+            }
+            return [200, response_headers, json.dumps(result)]
+
+        httpretty.register_uri(
+            httpretty.GET,
+            urllib.parse.urljoin(f"http://localhost/{API_BASE}", f"composes/{compose_id}"),
+            body=compose_status
+        )
+
+        client = self.plugin.Client("http://localhost")
+        with unittest.mock.patch.object(self.plugin.time, "sleep"):
+            status = client.wait_for_compose(compose_id)
+
+        self.assertTrue(status.is_success)
+        self.assertEqual(len(calls), 7)
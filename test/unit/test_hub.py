@@ -88,6 +88,119 @@ class TestHubPlugin(PluginTest):
 
         self.plugin.osbuildImage(*args, {})
 
+    def test_batch(self):
+        context = self.mock_koji_context()
+
+        opts = {"repo": ["repo1", "repo2"],
+                "release": "1.2.3",
+                "skip_tag": True}
+        batch = [
+            ["name", "version", "distro",
+             "image_type",
+             "target",
+             ["x86_64"],
+             opts],
+            ["name", "version", "distro",
+             ["image_type"],
+             "target",
+             ["aarch64"],
+             opts]
+        ]
+
+        task = {"channel": "image"}
+
+        kojihub = flexmock()
+        kojihub.should_receive("make_task") \
+               .with_args("osbuildImage", batch[0], **task) \
+               .and_return(1)
+        kojihub.should_receive("make_task") \
+               .with_args("osbuildImage", [*batch[1][:3], "image_type", *batch[1][4:]], **task) \
+               .and_return(2)
+
+        setattr(self.plugin, "context", context)
+        setattr(self.plugin, "kojihub", kojihub)
+
+        res = self.plugin.osbuildImages(batch)
+        self.assertEqual(res, [1, 2])
+
+    def test_batch_priority(self):
+        context = self.mock_koji_context()
+
+        opts = {}
+        args = ["name", "version", "distro",
+                "image_type",
+                "target",
+                ["x86_64"],
+                opts]
+
+        task = {"channel": "image", "priority": koji.PRIO_DEFAULT + 5}
+
+        kojihub = flexmock()
+        kojihub.should_receive("make_task") \
+               .with_args("osbuildImage", args, **task) \
+               .and_return(1) \
+               .once()
+
+        setattr(self.plugin, "context", context)
+        setattr(self.plugin, "kojihub", kojihub)
+
+        res = self.plugin.osbuildImages([args], priority=5)
+        self.assertEqual(res, [1])
+
+    def test_batch_validation(self):
+        context = self.mock_koji_context()
+
+        opts = {}
+        batch = [
+            ["name", "version", "distro",
+             "image_type",
+             "target",
+             ["x86_64"],
+             opts],
+            ["name", "version", "distro",
+             "image_type",
+             "target",
+             [],  # at least one architecture is required
+             opts]
+        ]
+
+        # no task must be created if any of the entries is invalid
+        kojihub = flexmock()
+        kojihub.should_receive("make_task").never()
+
+        setattr(self.plugin, "context", context)
+        setattr(self.plugin, "kojihub", kojihub)
+
+        with self.assertRaises(koji.ParameterError):
+            self.plugin.osbuildImages(batch)
+
+    def test_batch_type_validation(self):
+        kojihub = flexmock()
+        kojihub.should_receive("make_task").never()
+        setattr(self.plugin, "kojihub", kojihub)
+
+        args = ["name", "version", "distro",
+                "image_type",
+                "target",
+                ["x86_64"],
+                {}]
+
+        invalid = [
+            None,
+            "batch",
+            {"args": args},
+            [],
+            [args, None],
+            [args, {"name": "name"}],
+            [args] * (self.plugin.OSBUILD_IMAGES_MAX_BATCH + 1)
+        ]
+
+        for batch in invalid:
+            context = self.mock_koji_context()
+            setattr(self.plugin, "context", context)
+            with self.assertRaises(koji.ParameterError):
+                self.plugin.osbuildImages(batch)
+
     def test_input_validation(self):
         context = self.mock_koji_context()
         setattr(self.plugin, "context", context)